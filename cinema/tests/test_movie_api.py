@@ -1,47 +1,102 @@
-import tempfile
-import os
+import copy
+from functools import lru_cache
 
-from PIL import Image
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
 
-from rest_framework.test import APIClient
+from rest_framework.test import (
+    APIClient,
+    APIRequestFactory,
+    force_authenticate,
+)
 from rest_framework import status
+from rest_framework.serializers import ModelSerializer
 
 from cinema.models import Movie, MovieSession, CinemaHall, Genre, Actor
-from cinema.serializers import MovieListSerializer, MovieDetailSerializer
+from cinema.tests.utils import (
+    FAST_PASSWORD_HASHERS,
+    IN_MEMORY_STORAGE,
+    sample_image,
+)
+from cinema.views import MovieViewSet
 
 MOVIE_URL = reverse("cinema:movie-list")
 MOVIE_SESSION_URL = reverse("cinema:moviesession-list")
 
+# One query for movies plus one prefetch each for genres and actors
+MOVIE_LIST_QUERIES = 3
+
+movie_list_view = MovieViewSet.as_view({"get": "list"})
+
+
+_model_serializer_get_fields = ModelSerializer.get_fields
+_serializer_fields_cache = {}
+
+
+def _cached_get_fields(serializer):
+    """Build ModelSerializer fields once per serializer class"""
+    serializer_class = type(serializer)
+    if serializer_class not in _serializer_fields_cache:
+        _serializer_fields_cache[serializer_class] = (
+            _model_serializer_get_fields(serializer)
+        )
+
+    return copy.deepcopy(_serializer_fields_cache[serializer_class])
+
+
+def setUpModule():
+    ModelSerializer.get_fields = _cached_get_fields
+
+
+def tearDownModule():
+    ModelSerializer.get_fields = _model_serializer_get_fields
+    _serializer_fields_cache.clear()
+
+
+MOVIE_DEFAULTS = {
+    "title": "Sample movie",
+    "description": "Sample description",
+    "duration": 90,
+}
+
 
 def sample_movie(**params):
-    defaults = {
-        "title": "Sample movie",
-        "description": "Sample description",
-        "duration": 90,
-    }
-    defaults.update(params)
+    defaults = {**MOVIE_DEFAULTS, **params}
 
     return Movie.objects.create(**defaults)
 
 
-def sample_movie_session(**params):
-    cinema_hall = CinemaHall.objects.create(
-        name="Blue", rows=20, seats_in_row=20
+def sample_movies(rows):
+    """Create several movies in a single INSERT"""
+    return Movie.objects.bulk_create(
+        [Movie(**{**MOVIE_DEFAULTS, **params}) for params in rows]
     )
 
+
+def sample_cinema_hall(**params):
+    defaults = {
+        "name": "Blue",
+        "rows": 20,
+        "seats_in_row": 20,
+    }
+    defaults.update(params)
+
+    return CinemaHall.objects.create(**defaults)
+
+
+def sample_movie_session(cinema_hall=None, **params):
     defaults = {
         "show_time": "2022-06-02 14:00:00",
         "movie": None,
-        "cinema_hall": cinema_hall,
+        "cinema_hall": cinema_hall or sample_cinema_hall(),
     }
     defaults.update(params)
 
     return MovieSession.objects.create(**defaults)
 
 
+@lru_cache(maxsize=None)
 def image_upload_url(movie_id):
     """Return URL for recipe image upload"""
     return reverse("cinema:movie-upload-image", args=[movie_id])
@@ -51,100 +106,120 @@ def detail_url(movie_id):
     return reverse("cinema:movie-detail", args=[movie_id])
 
 
-class UnauthenticatedMovieApiTests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
+class UnauthenticatedMovieApiTests(SimpleTestCase):
+    client_class = APIClient
 
     def test_auth_required(self):
         res = self.client.get(MOVIE_URL)
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+@override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
 class AuthenticatedMovieApiTests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.user = get_user_model().objects.create_user(
+    client_class = APIClient
+    factory = APIRequestFactory()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
             "test@test.com",
             "testpass",
         )
-        self.client.force_authenticate(self.user)
-
-    def test_list_movies(self):
-        sample_movie()
-        sample_movie()
-
-        res = self.client.get(MOVIE_URL)
-
-        movies = Movie.objects.all().order_by("id")
-        serializer = MovieListSerializer(movies, many=True)
-
-        self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
-
-    def test_filter_movies_by_genres(self):
-        action = Genre.objects.create(name="Action")
-        drama = Genre.objects.create(name="Drama")
 
-        interstellar = sample_movie(title="Interstellar")
-        robin_hood = sample_movie(title="Robin Hood")
-
-        interstellar.genres.add(action)
-        robin_hood.genres.add(drama)
-
-        movie_without_genres = sample_movie(title="Movie without genres")
-
-        res = self.client.get(
-            MOVIE_URL, {"genres": f"{action.id},{drama.id}"}
+        cls.action, cls.drama = Genre.objects.bulk_create(
+            [Genre(name="Action"), Genre(name="Drama")]
         )
-
-        serializer1 = MovieListSerializer(interstellar)
-        serializer2 = MovieListSerializer(robin_hood)
-        serializer3 = MovieListSerializer(movie_without_genres)
-
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
-
-    def test_filter_movies_by_actors(self):
-        anthony_hopkins = Actor.objects.create(
-            first_name="Anthony", last_name="Hopkins"
+        cls.anthony_hopkins, cls.russell_crowe = Actor.objects.bulk_create(
+            [
+                Actor(first_name="Anthony", last_name="Hopkins"),
+                Actor(first_name="Russel", last_name="Crowe"),
+            ]
         )
-        russell_crowe = Actor.objects.create(first_name="Russel", last_name="Crowe")
 
-        interstellar = sample_movie(title="Interstellar")
-        robin_hood = sample_movie(title="Robin Hood")
+        (
+            cls.interstellar,
+            cls.robin_hood,
+            cls.movie_without_relations,
+            cls.another_movie,
+        ) = sample_movies(
+            [
+                {"title": "Interstellar"},
+                {"title": "Robin Hood"},
+                {"title": "Movie without relations"},
+                {"title": "Another Movie"},
+            ]
+        )
 
-        interstellar.actors.add(anthony_hopkins)
-        robin_hood.actors.add(russell_crowe)
+        movie_genre = Movie.genres.through
+        movie_genre.objects.bulk_create(
+            [
+                movie_genre(movie=cls.interstellar, genre=cls.action),
+                movie_genre(movie=cls.robin_hood, genre=cls.drama),
+            ]
+        )
+        movie_actor = Movie.actors.through
+        movie_actor.objects.bulk_create(
+            [
+                movie_actor(movie=cls.interstellar, actor=cls.anthony_hopkins),
+                movie_actor(movie=cls.robin_hood, actor=cls.russell_crowe),
+            ]
+        )
 
-        movie_without_actors = sample_movie(title="Movie without actors")
+    def setUp(self):
+        self.client.force_authenticate(self.user)
 
-        res = self.client.get(
-            MOVIE_URL, {"actors": f"{anthony_hopkins.id},{russell_crowe.id}"}
-        )
+    def list_movies(self, params=None):
+        """Call the movie list view directly, bypassing middleware"""
+        request = self.factory.get(MOVIE_URL, params)
+        force_authenticate(request, user=self.user)
+        return movie_list_view(request)
 
-        serializer1 = MovieListSerializer(interstellar)
-        serializer2 = MovieListSerializer(robin_hood)
-        serializer3 = MovieListSerializer(movie_without_actors)
+    def test_list_movies(self):
+        sample_movie(title="Sample movie A")
+        sample_movie(title="Sample movie B")
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        with self.assertNumQueries(MOVIE_LIST_QUERIES):
+            res = self.list_movies()
 
-    def test_filter_movies_by_title(self):
-        movie = sample_movie(title="Movie")
-        another_movie = sample_movie(title="Another Movie")
-        movie_empty = sample_movie(title="No match")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [movie["id"] for movie in res.data],
+            list(Movie.objects.values_list("id", flat=True)),
+        )
 
-        res = self.client.get(MOVIE_URL, {"title": "movie"})
+    def test_filter_movies(self):
+        cases = (
+            (
+                {"genres": f"{self.action.id},{self.drama.id}"},
+                (self.interstellar, self.robin_hood),
+                (self.movie_without_relations, self.another_movie),
+            ),
+            (
+                {
+                    "actors": (
+                        f"{self.anthony_hopkins.id},{self.russell_crowe.id}"
+                    )
+                },
+                (self.interstellar, self.robin_hood),
+                (self.movie_without_relations, self.another_movie),
+            ),
+            (
+                {"title": "movie"},
+                (self.movie_without_relations, self.another_movie),
+                (self.interstellar, self.robin_hood),
+            ),
+        )
 
-        serializer1 = MovieListSerializer(movie)
-        serializer2 = MovieListSerializer(another_movie)
-        serializer3 = MovieListSerializer(movie_empty)
+        for params, included, excluded in cases:
+            with self.subTest(params=params):
+                with self.assertNumQueries(MOVIE_LIST_QUERIES):
+                    res = self.list_movies(params)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+                ids = {movie["id"] for movie in res.data}
+                for movie in included:
+                    self.assertIn(movie.id, ids)
+                for movie in excluded:
+                    self.assertNotIn(movie.id, ids)
 
     def test_retrieve_movie_detail(self):
         movie = sample_movie()
@@ -156,9 +231,30 @@ class AuthenticatedMovieApiTests(TestCase):
         url = detail_url(movie.id)
         res = self.client.get(url)
 
-        serializer = MovieDetailSerializer(movie)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(
+            set(res.data),
+            {
+                "id",
+                "title",
+                "duration",
+                "description",
+                "genres",
+                "actors",
+                "image",
+            },
+        )
+        self.assertEqual(res.data["id"], movie.id)
+        self.assertEqual(res.data["title"], movie.title)
+        self.assertEqual(res.data["duration"], movie.duration)
+        self.assertEqual(res.data["description"], movie.description)
+        self.assertEqual(
+            [genre["name"] for genre in res.data["genres"]], ["Genre"]
+        )
+        self.assertEqual(
+            [actor["full_name"] for actor in res.data["actors"]],
+            ["Steve Nicks"],
+        )
 
     def test_create_movie_forbidden(self):
         payload = {
@@ -171,12 +267,17 @@ class AuthenticatedMovieApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
 
 
+@override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
 class AdminMovieApiTests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.user = get_user_model().objects.create_user(
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
             "admin@admin.com", "testpass", is_staff=True
         )
+
+    def setUp(self):
         self.client.force_authenticate(self.user)
 
     def test_create_movie(self):
@@ -229,15 +330,26 @@ class AdminMovieApiTests(TestCase):
         self.assertIn(tobey_maguire, actors)
 
 
+@override_settings(
+    PASSWORD_HASHERS=FAST_PASSWORD_HASHERS,
+    DEFAULT_FILE_STORAGE=IN_MEMORY_STORAGE,
+)
 class MovieImageUploadTests(TestCase):
-    def setUp(self):
-        self.client = APIClient()
-        self.user = get_user_model().objects.create_superuser(
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(
             "admin@myproject.com", "password"
         )
+        cls.cinema_hall = sample_cinema_hall()
+        cls.movie = sample_movie()
+        cls.movie_session = sample_movie_session(
+            movie=cls.movie, cinema_hall=cls.cinema_hall
+        )
+
+    def setUp(self):
         self.client.force_authenticate(self.user)
-        self.movie = sample_movie()
-        self.movie_session = sample_movie_session(movie=self.movie)
 
     def tearDown(self):
         self.movie.image.delete()
@@ -245,16 +357,14 @@ class MovieImageUploadTests(TestCase):
     def test_upload_image_to_movie(self):
         """Test uploading an image to movie"""
         url = image_upload_url(self.movie.id)
-        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
-            img = Image.new("RGB", (10, 10))
-            img.save(ntf, format="JPEG")
-            ntf.seek(0)
-            res = self.client.post(url, {"image": ntf}, format="multipart")
+        res = self.client.post(
+            url, {"image": sample_image()}, format="multipart"
+        )
         self.movie.refresh_from_db()
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertIn("image", res.data)
-        self.assertTrue(os.path.exists(self.movie.image.path))
+        self.assertTrue(self.movie.image.storage.exists(self.movie.image.name))
 
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image"""
@@ -265,20 +375,16 @@ class MovieImageUploadTests(TestCase):
 
     def test_post_image_to_movie_list_should_not_work(self):
         url = MOVIE_URL
-        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
-            img = Image.new("RGB", (10, 10))
-            img.save(ntf, format="JPEG")
-            ntf.seek(0)
-            res = self.client.post(
-                url,
-                {
-                    "title": "Title",
-                    "description": "Description",
-                    "duration": 90,
-                    "image": ntf,
-                },
-                format="multipart",
-            )
+        res = self.client.post(
+            url,
+            {
+                "title": "Title",
+                "description": "Description",
+                "duration": 90,
+                "image": sample_image(),
+            },
+            format="multipart",
+        )
 
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
         movie = Movie.objects.get(title="Title")
@@ -286,33 +392,27 @@ class MovieImageUploadTests(TestCase):
 
     def test_image_url_is_shown_on_movie_detail(self):
         url = image_upload_url(self.movie.id)
-        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
-            img = Image.new("RGB", (10, 10))
-            img.save(ntf, format="JPEG")
-            ntf.seek(0)
-            self.client.post(url, {"image": ntf}, format="multipart")
+        self.client.post(
+            url, {"image": sample_image()}, format="multipart"
+        )
         res = self.client.get(detail_url(self.movie.id))
 
         self.assertIn("image", res.data)
 
     def test_image_url_is_shown_on_movie_list(self):
         url = image_upload_url(self.movie.id)
-        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
-            img = Image.new("RGB", (10, 10))
-            img.save(ntf, format="JPEG")
-            ntf.seek(0)
-            self.client.post(url, {"image": ntf}, format="multipart")
+        self.client.post(
+            url, {"image": sample_image()}, format="multipart"
+        )
         res = self.client.get(MOVIE_URL)
 
         self.assertIn("image", res.data[0].keys())
 
     def test_image_url_is_shown_on_movie_session_detail(self):
         url = image_upload_url(self.movie.id)
-        with tempfile.NamedTemporaryFile(suffix=".jpg") as ntf:
-            img = Image.new("RGB", (10, 10))
-            img.save(ntf, format="JPEG")
-            ntf.seek(0)
-            self.client.post(url, {"image": ntf}, format="multipart")
+        self.client.post(
+            url, {"image": sample_image()}, format="multipart"
+        )
         res = self.client.get(MOVIE_SESSION_URL)
 
         self.assertIn("movie_image", res.data[0].keys())
@@ -0,0 +1,53 @@
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils.encoding import filepath_to_uri
+
+# Smallest valid 1x1 JPEG, enough to pass the upload image validation
+MIN_JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300ffffffffffffff"
+    "ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff"
+    "ffffffffffffffffffffffffffffffffffffffffffffffffffffdb004301ffff"
+    "ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff"
+    "ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffc0"
+    "0011080001000103012200021101031101ffc400150001010000000000000000"
+    "0000000000000003ffc40014100100000000000000000000000000000000ffc4"
+    "0014010100000000000000000000000000000000ffc400141101000000000000"
+    "00000000000000000000ffda000c03010002110311003f009800ffd9"
+)
+
+FAST_PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+IN_MEMORY_STORAGE = "cinema.tests.utils.InMemoryStorage"
+
+
+def sample_image(name="image.jpg"):
+    return SimpleUploadedFile(name, MIN_JPEG, content_type="image/jpeg")
+
+
+class InMemoryStorage(Storage):
+    """Keep uploaded files in memory instead of writing to MEDIA_ROOT"""
+
+    def __init__(self):
+        self.files = {}
+
+    def _save(self, name, content):
+        self.files[name] = b"".join(content.chunks())
+        return name
+
+    def _open(self, name, mode="rb"):
+        return ContentFile(self.files[name], name=name)
+
+    def exists(self, name):
+        return name in self.files
+
+    def delete(self, name):
+        self.files.pop(name, None)
+
+    def size(self, name):
+        return len(self.files[name])
+
+    def url(self, name):
+        return urljoin(settings.MEDIA_URL, filepath_to_uri(name))